@@ -1,12 +1,32 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
-from datetime import datetime, timedelta
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select, update, and_, or_, func, case, lambda_stmt
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional
 from passlib.context import CryptContext
 
 from app import models, schemas
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# argon2id dengan budget memory/time eksplisit (OWASP baseline);
+# bcrypt tetap di daftar supaya hash lama masih bisa diverifikasi -
+# authenticate_user meng-upgrade hash deprecated lewat
+# verify_and_update() saat login berhasil
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+)
+
+def utcnow() -> datetime:
+    """
+    UTC sekarang sebagai naive datetime. datetime.utcnow() sudah
+    deprecated; kolom DateTime kita tz-naive (konvensi UTC) dan asyncpg
+    menolak parameter aware untuk kolom naive, makanya tzinfo dilepas.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 # ============ User CRUD ============
 def get_password_hash(password: str) -> str:
@@ -15,84 +35,131 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    # lambda_stmt: SQL-nya dicompile sekali per process, call berikutnya
+    # tinggal bind parameter - query ini jalan di setiap request
+    # ter-autentikasi lewat get_current_user
+    stmt = lambda_stmt(
+        lambda: select(models.User).where(models.User.email == email)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().first()
 
-def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.User]:
+    result = await db.execute(
+        select(models.User).where(models.User.username == username)
+    )
+    return result.scalars().first()
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.User:
-    hashed_password = get_password_hash(user.password)
+async def get_user_by_email_or_username(
+    db: AsyncSession, email: str, username: str
+) -> Optional[models.User]:
+    """
+    Satu query untuk cek duplikat email/username sekaligus (dipakai
+    /register) - caller tinggal lihat field mana yang bentrok.
+    """
+    result = await db.execute(
+        select(models.User).where(
+            or_(
+                models.User.email == email,
+                models.User.username == username
+            )
+        )
+    )
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
+    # Hashing itu CPU-bound, jalankan di thread supaya event loop bebas
+    hashed_password = await asyncio.to_thread(get_password_hash, user.password)
     db_user = models.User(
         email=user.email,
         username=user.username,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
-    user = get_user_by_email(db, email)
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[models.User]:
+    user = await get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await asyncio.to_thread(
+        pwd_context.verify_and_update, password, user.hashed_password
+    )
+    if not valid:
         return None
+    if new_hash:
+        # Hash dengan skema deprecated (mis. bcrypt lama) di-upgrade
+        # transparan ke argon2id
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 # ============ Asset CRUD ============
-def get_asset_by_symbol(db: Session, symbol: str) -> Optional[models.Asset]:
-    return db.query(models.Asset).filter(models.Asset.symbol == symbol.upper()).first()
+async def get_asset_by_symbol(db: AsyncSession, symbol: str) -> Optional[models.Asset]:
+    result = await db.execute(
+        select(models.Asset).where(models.Asset.symbol == symbol.upper())
+    )
+    return result.scalars().first()
 
-def get_asset(db: Session, asset_id: int) -> Optional[models.Asset]:
-    return db.query(models.Asset).filter(models.Asset.id == asset_id).first()
+async def get_asset(db: AsyncSession, asset_id: int) -> Optional[models.Asset]:
+    # PK lookup lewat identity map - skip query compile kalau object
+    # sudah ada di session
+    return await db.get(models.Asset, asset_id)
 
-def get_assets(db: Session, skip: int = 0, limit: int = 100) -> List[models.Asset]:
-    return db.query(models.Asset).offset(skip).limit(limit).all()
+async def get_assets(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[models.Asset]:
+    result = await db.execute(
+        select(models.Asset).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
-def create_asset(db: Session, asset: schemas.AssetCreate) -> models.Asset:
+async def create_asset(db: AsyncSession, asset: schemas.AssetCreate) -> models.Asset:
     db_asset = models.Asset(
         symbol=asset.symbol.upper(),
         name=asset.name,
         asset_type=asset.asset_type
     )
     db.add(db_asset)
-    db.commit()
-    db.refresh(db_asset)
+    await db.commit()
+    await db.refresh(db_asset)
     return db_asset
 
 # ============ Transaction CRUD ============
-def get_transactions(
-    db: Session, 
-    user_id: int, 
-    skip: int = 0, 
+async def get_transactions(
+    db: AsyncSession,
+    user_id: int,
+    skip: int = 0,
     limit: int = 100
 ) -> List[models.Transaction]:
-    return db.query(models.Transaction)\
-        .filter(models.Transaction.user_id == user_id)\
-        .order_by(models.Transaction.transaction_date.desc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-
-def get_transaction(db: Session, transaction_id: int, user_id: int) -> Optional[models.Transaction]:
-    return db.query(models.Transaction)\
-        .filter(
-            and_(
-                models.Transaction.id == transaction_id,
-                models.Transaction.user_id == user_id
-            )
-        ).first()
+    stmt = lambda_stmt(
+        lambda: select(models.Transaction)
+        .options(joinedload(models.Transaction.asset))
+        .where(models.Transaction.user_id == user_id)
+        .order_by(models.Transaction.transaction_date.desc())
+    )
+    stmt += lambda s: s.offset(skip).limit(limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+async def get_transaction(
+    db: AsyncSession, transaction_id: int, user_id: int
+) -> Optional[models.Transaction]:
+    # PK lookup via identity map; ownership check cukup di Python
+    transaction = await db.get(models.Transaction, transaction_id)
+    if transaction is None or transaction.user_id != user_id:
+        return None
+    return transaction
 
-def create_transaction(
-    db: Session, 
-    transaction: schemas.TransactionCreate, 
+async def create_transaction(
+    db: AsyncSession,
+    transaction: schemas.TransactionCreate,
     user_id: int
 ) -> models.Transaction:
     # Calculate total amount
     total_amount = (transaction.quantity * transaction.price) + transaction.fee
-    
+
     # Create transaction
     db_transaction = models.Transaction(
         user_id=user_id,
@@ -105,51 +172,117 @@ def create_transaction(
         transaction_date=transaction.transaction_date,
         notes=transaction.notes
     )
-    
+
+    # Flush (bukan commit) untuk dapat primary key; satu commit terminal
+    # di bawah mencakup insert + position update - 1 fsync, bukan 2
     db.add(db_transaction)
-    db.commit()
-    
+    await db.flush()
+
     # Update or create position
-    update_position_after_transaction(db, db_transaction)
-    
-    db.refresh(db_transaction)
+    await update_position_after_transaction(db, db_transaction)
+
+    await db.commit()
+
+    # Load relationship asset secara eksplisit (lazy load tidak jalan
+    # di async session)
+    await db.refresh(db_transaction, ["asset"])
     return db_transaction
 
-def delete_transaction(db: Session, transaction_id: int, user_id: int) -> bool:
-    transaction = get_transaction(db, transaction_id, user_id)
+async def create_transactions_bulk(
+    db: AsyncSession,
+    transactions: List[schemas.TransactionCreate],
+    user_id: int
+) -> List[models.Transaction]:
+    """
+    Bulk import transactions dengan batched insert.
+
+    Semua row di-insert dalam satu flush (asyncpg mengirimnya sebagai
+    batch), lalu position di-recalculate sekali per asset - bukan satu
+    round trip per transaction.
+    """
+    db_transactions = [
+        models.Transaction(
+            user_id=user_id,
+            asset_id=transaction.asset_id,
+            transaction_type=transaction.transaction_type,
+            quantity=transaction.quantity,
+            price=transaction.price,
+            fee=transaction.fee,
+            total_amount=(transaction.quantity * transaction.price) + transaction.fee,
+            transaction_date=transaction.transaction_date,
+            notes=transaction.notes
+        )
+        for transaction in transactions
+    ]
+
+    db.add_all(db_transactions)
+    await db.flush()
+
+    # Recalculate position sekali per asset yang kena, lalu satu commit
+    # terminal - import-nya all-or-nothing
+    affected_asset_ids = {t.asset_id for t in db_transactions}
+    for asset_id in affected_asset_ids:
+        await recalculate_position(db, user_id, asset_id)
+
+    await db.commit()
+
+    # Reload dengan asset relationship untuk response; populate_existing
+    # supaya realized_pnl hasil recalculate ikut ter-refresh, bukan
+    # nilai lama dari identity map
+    result = await db.execute(
+        select(models.Transaction)
+        .options(joinedload(models.Transaction.asset))
+        .where(models.Transaction.id.in_([t.id for t in db_transactions]))
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().all()
+
+async def delete_transaction(db: AsyncSession, transaction_id: int, user_id: int) -> bool:
+    transaction = await get_transaction(db, transaction_id, user_id)
     if transaction:
-        db.delete(transaction)
-        db.commit()
-        # Recalculate positions after deletion
-        recalculate_position(db, user_id, transaction.asset_id)
+        asset_id = transaction.asset_id
+        await db.delete(transaction)
+        await db.flush()
+        # Recalculate positions after deletion; satu commit terminal
+        # mencakup delete + position baru
+        await recalculate_position(db, user_id, asset_id)
+        await db.commit()
         return True
     return False
 
 # ============ Position CRUD ============
-def get_positions(db: Session, user_id: int) -> List[models.Position]:
-    return db.query(models.Position)\
-        .filter(models.Position.user_id == user_id)\
-        .all()
-
-def get_position_by_asset(
-    db: Session, 
-    user_id: int, 
+async def get_positions(db: AsyncSession, user_id: int) -> List[models.Position]:
+    result = await db.execute(
+        select(models.Position)
+        .options(joinedload(models.Position.asset))
+        .where(models.Position.user_id == user_id)
+    )
+    return result.scalars().all()
+
+async def get_position_by_asset(
+    db: AsyncSession,
+    user_id: int,
     asset_id: int
 ) -> Optional[models.Position]:
-    return db.query(models.Position)\
-        .filter(
+    stmt = lambda_stmt(
+        lambda: select(models.Position).where(
             and_(
                 models.Position.user_id == user_id,
                 models.Position.asset_id == asset_id
             )
-        ).first()
+        )
+    )
+    result = await db.execute(stmt)
+    return result.scalars().first()
 
-def update_position_after_transaction(db: Session, transaction: models.Transaction):
+async def update_position_after_transaction(db: AsyncSession, transaction: models.Transaction):
     """
-    Update atau create position setelah transaction
+    Update atau create position setelah transaction.
+
+    Tidak commit sendiri - caller yang pegang satu commit terminal.
     """
-    position = get_position_by_asset(db, transaction.user_id, transaction.asset_id)
-    
+    position = await get_position_by_asset(db, transaction.user_id, transaction.asset_id)
+
     if transaction.transaction_type == models.TransactionType.BUY:
         if position:
             # Update existing position
@@ -168,93 +301,216 @@ def update_position_after_transaction(db: Session, transaction: models.Transacti
                 average_buy_price=transaction.price
             )
             db.add(position)
-    
+
     elif transaction.transaction_type == models.TransactionType.SELL:
         if position:
             # Calculate realized PnL
             realized_pnl = (transaction.price - position.average_buy_price) * transaction.quantity
             transaction.realized_pnl = realized_pnl
-            
+
             # Update position
             position.quantity -= transaction.quantity
             position.total_invested -= (position.average_buy_price * transaction.quantity)
-            
+
             # Delete position if quantity is 0
             if position.quantity <= 0:
-                db.delete(position)
-    
-    db.commit()
+                await db.delete(position)
 
-def recalculate_position(db: Session, user_id: int, asset_id: int):
+async def recalculate_position(db: AsyncSession, user_id: int, asset_id: int):
     """
-    Recalculate position dari semua transactions
+    Recalculate position dari semua transactions.
+
+    Semua perhitungan dilakukan in-memory, bukan satu commit per
+    transaction. Average-cost basis tergantung urutan buy/sell, jadi
+    replay tetap diperlukan - tapi tanpa round trip per row.
+
+    Tidak commit sendiri - caller yang pegang satu commit terminal,
+    supaya delete/bulk-import tetap atomic.
     """
-    # Delete existing position
-    position = get_position_by_asset(db, user_id, asset_id)
+    # Delete existing position (masih dalam transaction yang sama).
+    # Flush supaya DELETE keluar sebelum INSERT position baru -
+    # unit of work menjalankan insert duluan dan itu menabrak
+    # unique index (user_id, asset_id)
+    position = await get_position_by_asset(db, user_id, asset_id)
     if position:
-        db.delete(position)
-        db.commit()
-    
-    # Get all transactions untuk asset ini
-    transactions = db.query(models.Transaction)\
-        .filter(
+        await db.delete(position)
+        await db.flush()
+
+    # Ambil hanya kolom yang dipakai replay - Row tuple ringan,
+    # tanpa hydration ORM object penuh per transaction
+    result = await db.execute(
+        select(
+            models.Transaction.id,
+            models.Transaction.transaction_type,
+            models.Transaction.quantity,
+            models.Transaction.price,
+            models.Transaction.total_amount
+        )
+        .where(
             and_(
                 models.Transaction.user_id == user_id,
                 models.Transaction.asset_id == asset_id
             )
-        )\
-        .order_by(models.Transaction.transaction_date)\
-        .all()
-    
-    # Recalculate dari awal
+        )
+        .order_by(models.Transaction.transaction_date)
+    )
+    transactions = result.all()
+
+    # Replay dari awal dengan accumulator lokal
+    quantity = 0.0
+    total_invested = 0.0
+    average_buy_price = 0.0
+    realized_updates = []
+
     for trans in transactions:
-        update_position_after_transaction(db, trans)
+        if trans.transaction_type == models.TransactionType.BUY:
+            opening_buy = quantity <= 0
+            quantity += trans.quantity
+            total_invested += trans.total_amount
+            if opening_buy:
+                # Live path membuka position dengan average = price
+                # (fee masuk total_invested, bukan ke basis harga) -
+                # replay harus identik supaya recalculation tidak
+                # menulis ulang PnL yang sudah tercatat
+                average_buy_price = trans.price
+            else:
+                average_buy_price = total_invested / quantity
+        elif trans.transaction_type == models.TransactionType.SELL:
+            if quantity <= 0:
+                # Sell tanpa holdings: live path
+                # (update_position_after_transaction) melewatkannya dan
+                # realized_pnl tetap 0 - replay harus sama, jangan
+                # back-fill PnL atau menarik quantity jadi negatif
+                realized_updates.append({"id": trans.id, "realized_pnl": 0.0})
+                continue
+            realized_updates.append({
+                "id": trans.id,
+                "realized_pnl": (trans.price - average_buy_price) * trans.quantity
+            })
+            quantity -= trans.quantity
+            total_invested -= average_buy_price * trans.quantity
+            if quantity <= 0:
+                # Live path menghapus position saat quantity habis;
+                # buy berikutnya mulai dari basis bersih
+                quantity = 0.0
+                total_invested = 0.0
+
+    # Tulis realized_pnl hasil replay sebagai satu bulk UPDATE by PK
+    if realized_updates:
+        await db.execute(update(models.Transaction), realized_updates)
+
+    # Satu insert kalau masih ada holdings
+    if quantity > 0:
+        db.add(models.Position(
+            user_id=user_id,
+            asset_id=asset_id,
+            quantity=quantity,
+            total_invested=total_invested,
+            average_buy_price=average_buy_price
+        ))
 
 # ============ Analytics ============
-def get_portfolio_summary(db: Session, user_id: int) -> dict:
+async def get_portfolio_summary_version(db: AsyncSession, user_id: int) -> tuple:
+    """
+    Version key murah untuk cache summary: berubah setiap ada write
+    ke transactions/positions milik user (insert menaikkan max id,
+    update/delete menyentuh last_updated atau menghapus row).
     """
-    Get portfolio summary dengan PnL analytics
+    result = await db.execute(
+        select(
+            func.max(models.Transaction.id),
+            func.count(models.Transaction.id)
+        ).where(models.Transaction.user_id == user_id)
+    )
+    max_tx_id, tx_count = result.one()
+
+    result = await db.execute(
+        select(
+            func.max(models.Position.last_updated),
+            func.count(models.Position.id)
+        ).where(models.Position.user_id == user_id)
+    )
+    max_pos_updated, pos_count = result.one()
+
+    return (max_tx_id, tx_count, str(max_pos_updated), pos_count)
+
+async def get_portfolio_summary(db: AsyncSession, user_id: int) -> dict:
     """
-    positions = get_positions(db, user_id)
-    transactions = get_transactions(db, user_id, limit=10000)
-    
-    total_invested = sum(p.total_invested for p in positions)
-    current_value = sum(p.current_value for p in positions)
-    unrealized_pnl = sum(p.unrealized_pnl for p in positions)
-    realized_pnl = sum(t.realized_pnl for t in transactions if t.transaction_type == models.TransactionType.SELL)
-    
+    Get portfolio summary dengan PnL analytics.
+
+    Semua total dihitung dengan SQL aggregate - DB hanya mengirim
+    beberapa scalar, bukan ribuan row untuk dijumlah di Python.
+    """
+    result = await db.execute(
+        select(
+            func.coalesce(func.sum(models.Position.total_invested), 0.0),
+            func.coalesce(func.sum(models.Position.current_value), 0.0),
+            func.coalesce(func.sum(models.Position.unrealized_pnl), 0.0),
+            func.count(models.Position.id)
+        ).where(models.Position.user_id == user_id)
+    )
+    total_invested, current_value, unrealized_pnl, total_positions = result.one()
+
+    # Satu statement untuk semua window (7d/30d/1y/all): tiap window
+    # menyumbang kolom realized_* dan invested_* via SUM(CASE), plus
+    # count - satu scan transactions per summary
+    now = utcnow()
+    cutoffs = {
+        "7d": now - timedelta(days=7),
+        "30d": now - timedelta(days=30),
+        "1y": now - timedelta(days=365),
+        "all": None,
+    }
+
+    columns = [func.count(models.Transaction.id).label("tx_count")]
+    for key, cutoff in cutoffs.items():
+        sell_cond = models.Transaction.transaction_type == models.TransactionType.SELL
+        buy_cond = models.Transaction.transaction_type == models.TransactionType.BUY
+        if cutoff is not None:
+            sell_cond = and_(sell_cond, models.Transaction.transaction_date >= cutoff)
+            buy_cond = and_(buy_cond, models.Transaction.transaction_date >= cutoff)
+
+        columns.append(func.coalesce(func.sum(case(
+            (sell_cond, models.Transaction.realized_pnl), else_=0.0
+        )), 0.0).label(f"realized_{key}"))
+        columns.append(func.coalesce(func.sum(case(
+            (buy_cond, models.Transaction.total_amount), else_=0.0
+        )), 0.0).label(f"invested_{key}"))
+
+    result = await db.execute(
+        select(*columns).where(models.Transaction.user_id == user_id)
+    )
+    agg = result.mappings().one()
+
+    realized_pnl = agg["realized_all"]
+    total_transactions = agg["tx_count"]
     total_pnl = realized_pnl + unrealized_pnl
     total_pnl_percentage = (total_pnl / total_invested * 100) if total_invested > 0 else 0
-    
-    # Calculate PnL for different periods
-    now = datetime.utcnow()
-    
-    def calculate_period_pnl(days: int):
-        start_date = now - timedelta(days=days)
-        period_transactions = [t for t in transactions if t.transaction_date >= start_date]
-        period_realized = sum(t.realized_pnl for t in period_transactions if t.transaction_type == models.TransactionType.SELL)
+
+    def build_period_pnl(key: str, period_label: str):
+        period_realized = agg[f"realized_{key}"]
+        period_invested = agg[f"invested_{key}"]
         period_total = period_realized + unrealized_pnl
-        period_invested = sum(t.total_amount for t in period_transactions if t.transaction_type == models.TransactionType.BUY)
         period_percentage = (period_total / period_invested * 100) if period_invested > 0 else 0
-        
+
         return {
-            "period": f"{days}d",
+            "period": period_label,
             "total_pnl": period_total,
             "total_pnl_percentage": period_percentage,
             "realized_pnl": period_realized,
             "unrealized_pnl": unrealized_pnl
         }
-    
+
     return {
         "total_invested": total_invested,
         "current_value": current_value,
         "total_pnl": total_pnl,
         "total_pnl_percentage": total_pnl_percentage,
-        "total_positions": len(positions),
-        "total_transactions": len(transactions),
-        "pnl_7d": calculate_period_pnl(7),
-        "pnl_30d": calculate_period_pnl(30),
-        "pnl_1y": calculate_period_pnl(365),
+        "total_positions": total_positions,
+        "total_transactions": total_transactions,
+        "pnl_7d": build_period_pnl("7d", "7d"),
+        "pnl_30d": build_period_pnl("30d", "30d"),
+        "pnl_1y": build_period_pnl("1y", "365d"),
         "pnl_all": {
             "period": "all",
             "total_pnl": total_pnl,
@@ -262,4 +518,4 @@ def get_portfolio_summary(db: Session, user_id: int) -> dict:
             "realized_pnl": realized_pnl,
             "unrealized_pnl": unrealized_pnl
         }
-    }
\ No newline at end of file
+    }
@@ -1,11 +1,16 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import jwt
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List
+import hashlib
 import os
+import time
 from dotenv import load_dotenv
 
 from app import models, schemas, crud
@@ -13,15 +18,20 @@ from app.database import engine, get_db
 
 load_dotenv()
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="Portfolio Tracker API",
     description="API for tracking investment portfolio",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson (Rust) jauh lebih cepat dari json.dumps untuk list endpoint
+    default_response_class=ORJSONResponse
 )
 
+@app.on_event("startup")
+async def create_tables():
+    # create_all butuh koneksi sync-style, jalankan via run_sync
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+
 # CORS configuration
 origins = os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",")
 
@@ -35,39 +45,64 @@ app.add_middleware(
 
 # Security
 SECRET_KEY = os.getenv("SECRET_KEY")
+# Encode key ke bytes sekali di module load, bukan per encode/decode call
+SECRET_KEY_BYTES = SECRET_KEY.encode("utf-8") if SECRET_KEY else None
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# TypeAdapter memvalidasi + men-dump seluruh list sekali jalan di
+# pydantic-core, jauh lebih murah daripada FastAPI memproses per elemen
+transaction_list_adapter = TypeAdapter(List[schemas.Transaction])
+position_list_adapter = TypeAdapter(List[schemas.Position])
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY_BYTES, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Cache hasil decode JWT per token: HMAC verify itu pure CPU dan client
+# yang sama mengirim token yang sama berulang kali. Entry expire bareng
+# token-nya (exp claim), jadi tidak pernah lebih longgar dari decode asli
+_token_cache = {}
+_TOKEN_CACHE_MAX = 1024
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+
+    cached = _token_cache.get(token)
+    if cached and cached[1] > time.time():
+        email = cached[0]
+    else:
+        try:
+            payload = jwt.decode(token, SECRET_KEY_BYTES, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+        except jwt.InvalidTokenError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = crud.get_user_by_email(db, email=email)
+
+        exp = payload.get("exp")
+        if exp:
+            if len(_token_cache) >= _TOKEN_CACHE_MAX:
+                # Bound sederhana: buang semua, isi lagi organik
+                _token_cache.clear()
+            _token_cache[token] = (email, exp)
+
+    user = await crud.get_user_by_email(db, email=email)
     if user is None:
         raise credentials_exception
     return user
@@ -89,24 +124,26 @@ def health_check():
 # ============ Auth Routes ============
 
 @app.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    # Check if user exists
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    # Check if user exists - satu query untuk email dan username
+    db_user = await crud.get_user_by_email_or_username(
+        db, email=user.email, username=user.username
+    )
     if db_user:
+        if db_user.email == user.email:
+            raise HTTPException(status_code=400, detail="Email already registered")
         raise HTTPException(status_code=400, detail="Username already taken")
-    
-    return crud.create_user(db=db, user=user)
+
+    return await crud.create_user(db=db, user=user)
 
 @app.post("/token", response_model=schemas.Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
+    # verify_password tetap CPU-bound dan dijalankan via asyncio.to_thread
+    # di dalam authenticate_user
+    user = await crud.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -127,59 +164,79 @@ async def read_users_me(current_user: models.User = Depends(get_current_user)):
 # ============ Asset Routes ============
 
 @app.get("/assets", response_model=List[schemas.Asset])
-def get_assets(
+async def get_assets(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    assets = crud.get_assets(db, skip=skip, limit=limit)
+    assets = await crud.get_assets(db, skip=skip, limit=limit)
     return assets
 
 @app.post("/assets", response_model=schemas.Asset)
-def create_asset(
+async def create_asset(
     asset: schemas.AssetCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Check if asset already exists
-    db_asset = crud.get_asset_by_symbol(db, symbol=asset.symbol)
+    db_asset = await crud.get_asset_by_symbol(db, symbol=asset.symbol)
     if db_asset:
         raise HTTPException(status_code=400, detail="Asset already exists")
-    
-    return crud.create_asset(db=db, asset=asset)
+
+    return await crud.create_asset(db=db, asset=asset)
 
 # ============ Transaction Routes ============
 
 @app.get("/transactions", response_model=List[schemas.Transaction])
-def get_transactions(
+async def get_transactions(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    transactions = crud.get_transactions(db, user_id=current_user.id, skip=skip, limit=limit)
-    return transactions
+    transactions = await crud.get_transactions(db, user_id=current_user.id, skip=skip, limit=limit)
+    validated = transaction_list_adapter.validate_python(transactions, from_attributes=True)
+    return ORJSONResponse(transaction_list_adapter.dump_python(validated, mode="json"))
 
 @app.post("/transactions", response_model=schemas.Transaction)
-def create_transaction(
+async def create_transaction(
     transaction: schemas.TransactionCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Verify asset exists
-    asset = crud.get_asset(db, asset_id=transaction.asset_id)
+    asset = await crud.get_asset(db, asset_id=transaction.asset_id)
     if not asset:
         raise HTTPException(status_code=404, detail="Asset not found")
-    
-    return crud.create_transaction(db=db, transaction=transaction, user_id=current_user.id)
+
+    return await crud.create_transaction(db=db, transaction=transaction, user_id=current_user.id)
+
+@app.post("/transactions/bulk", response_model=List[schemas.Transaction])
+async def create_transactions_bulk(
+    transactions: List[schemas.TransactionCreate],
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # Verify all referenced assets exist (one query)
+    asset_ids = {t.asset_id for t in transactions}
+    result = await db.execute(
+        select(models.Asset.id).where(models.Asset.id.in_(asset_ids))
+    )
+    missing = asset_ids - set(result.scalars().all())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Assets not found: {sorted(missing)}")
+
+    created = await crud.create_transactions_bulk(db=db, transactions=transactions, user_id=current_user.id)
+    validated = transaction_list_adapter.validate_python(created, from_attributes=True)
+    return ORJSONResponse(transaction_list_adapter.dump_python(validated, mode="json"))
 
 @app.delete("/transactions/{transaction_id}")
-def delete_transaction(
+async def delete_transaction(
     transaction_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    success = crud.delete_transaction(db, transaction_id=transaction_id, user_id=current_user.id)
+    success = await crud.delete_transaction(db, transaction_id=transaction_id, user_id=current_user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Transaction not found")
     return {"message": "Transaction deleted successfully"}
@@ -187,21 +244,47 @@ def delete_transaction(
 # ============ Position Routes ============
 
 @app.get("/positions", response_model=List[schemas.Position])
-def get_positions(
-    db: Session = Depends(get_db),
+async def get_positions(
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    positions = crud.get_positions(db, user_id=current_user.id)
-    return positions
+    positions = await crud.get_positions(db, user_id=current_user.id)
+    validated = position_list_adapter.validate_python(positions, from_attributes=True)
+    return ORJSONResponse(position_list_adapter.dump_python(validated, mode="json"))
 
 # ============ Analytics Routes ============
 
+# In-process cache: user_id -> (etag, summary dict). Key-nya version
+# tuple dari transactions/positions, jadi invalidation otomatis saat
+# ada write - tidak perlu TTL. Bound sama seperti _token_cache: buang
+# semua saat penuh, isi lagi organik
+_summary_cache = {}
+_SUMMARY_CACHE_MAX = 1024
+
 @app.get("/portfolio/summary", response_model=schemas.PortfolioSummary)
-def get_portfolio_summary(
-    db: Session = Depends(get_db),
+async def get_portfolio_summary(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    summary = crud.get_portfolio_summary(db, user_id=current_user.id)
+    version = await crud.get_portfolio_summary_version(db, user_id=current_user.id)
+    etag = 'W/"' + hashlib.md5(repr(version).encode()).hexdigest() + '"'
+
+    # Client masih punya versi yang sama - skip transfer sama sekali
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    cached = _summary_cache.get(current_user.id)
+    if cached and cached[0] == etag:
+        summary = cached[1]
+    else:
+        summary = await crud.get_portfolio_summary(db, user_id=current_user.id)
+        if len(_summary_cache) >= _SUMMARY_CACHE_MAX:
+            _summary_cache.clear()
+        _summary_cache[current_user.id] = (etag, summary)
+
+    response.headers["ETag"] = etag
     return summary
 
 if __name__ == "__main__":
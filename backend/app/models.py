@@ -1,6 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, func, Enum as SQLEnum
 from sqlalchemy.orm import relationship
-from datetime import datetime
 import enum
 from app.database import Base
 
@@ -19,7 +18,7 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
     
     # Relationships
     transactions = relationship("Transaction", back_populates="user", cascade="all, delete-orphan")
@@ -32,7 +31,7 @@ class Asset(Base):
     symbol = Column(String, unique=True, index=True, nullable=False)  # BTC, AAPL, etc
     name = Column(String, nullable=False)  # Bitcoin, Apple Inc
     asset_type = Column(SQLEnum(AssetType), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
     
     # Relationships
     transactions = relationship("Transaction", back_populates="asset")
@@ -40,7 +39,13 @@ class Asset(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
-    
+    __table_args__ = (
+        # Covers get_transactions (filter user_id + ORDER BY date DESC)
+        Index("ix_tx_user_date", "user_id", "transaction_date"),
+        # Covers get_position_by_asset/recalculate_position lookups
+        Index("ix_tx_user_asset", "user_id", "asset_id"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     asset_id = Column(Integer, ForeignKey("assets.id"), nullable=False)
@@ -54,7 +59,7 @@ class Transaction(Base):
     realized_pnl = Column(Float, default=0.0)  # For sell transactions
     
     transaction_date = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
     notes = Column(String, nullable=True)
     
     # Relationships
@@ -63,7 +68,12 @@ class Transaction(Base):
 
 class Position(Base):
     __tablename__ = "positions"
-    
+    __table_args__ = (
+        # One position per user/asset; juga jadi B-tree lookup tunggal
+        # untuk get_position_by_asset
+        Index("ix_pos_user_asset", "user_id", "asset_id", unique=True),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     asset_id = Column(Integer, ForeignKey("assets.id"), nullable=False)
@@ -77,7 +87,7 @@ class Position(Base):
     unrealized_pnl = Column(Float, default=0.0)  # current_value - total_invested
     unrealized_pnl_percentage = Column(Float, default=0.0)
     
-    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_updated = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # Relationships
     user = relationship("User", back_populates="positions")
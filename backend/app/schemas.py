@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr, Field
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
+from datetime import datetime, timezone
 from typing import Optional
 from app.models import TransactionType, AssetType
 
@@ -19,8 +19,7 @@ class User(UserBase):
     id: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class Token(BaseModel):
     access_token: str
@@ -42,8 +41,7 @@ class Asset(AssetBase):
     id: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # ============ Transaction Schemas ============
 class TransactionBase(BaseModel):
@@ -55,6 +53,16 @@ class TransactionBase(BaseModel):
     transaction_date: datetime
     notes: Optional[str] = None
 
+    @field_validator("transaction_date")
+    @classmethod
+    def normalize_transaction_date(cls, value: datetime) -> datetime:
+        # Kolom DateTime kita tz-naive (konvensi UTC) dan asyncpg menolak
+        # parameter aware - timestamp ISO dengan offset/Z dari client
+        # dinormalisasi ke naive UTC di sini
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
 class TransactionCreate(TransactionBase):
     pass
 
@@ -68,8 +76,7 @@ class Transaction(TransactionBase):
     # Nested objects
     asset: Asset
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # ============ Position Schemas ============
 class PositionBase(BaseModel):
@@ -90,8 +97,7 @@ class Position(PositionBase):
     # Nested objects
     asset: Asset
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # ============ Dashboard/Analytics Schemas ============
 class PnLAnalytics(BaseModel):